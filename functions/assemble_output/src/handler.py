@@ -0,0 +1,134 @@
+import json
+import os
+import posixpath
+import urllib.parse
+
+import boto3
+
+ASSEMBLY_QUEUE = os.environ['ASSEMBLY_QUEUE']
+JOB_DESCRIPTOR = 'job.descriptor'
+ARCHIVE_NAME = 'sequence.tar'
+MANIFEST_NAME = 'manifest.json'
+OUTPUT_ROOT = 'render-output/'
+# Frame progress lives apart from render_jobs, whose items carry a five minute seconds_to_expire
+PROGRESS_TABLE = 'render_job_progress'
+SUMMARY = 'summary'
+
+print('Loading function')
+
+s3 = boto3.client('s3')
+dynamo = boto3.client('dynamodb')
+sqs = boto3.client('sqs')
+
+
+def execute(event, context):
+    bucket = event['Records'][0]['s3']['bucket']['name']
+    key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
+    if not is_frame_key(key):
+        return None
+
+    prefix = posixpath.dirname(key) + '/'
+    try:
+        job = load_job_descriptor(bucket, prefix)
+        if job is None:
+            print(f'No {JOB_DESCRIPTOR} under {prefix}, not a render job output')
+            return None
+
+        frame_number = parse_frame_number(key, job['output_name'])
+        if frame_number is None:
+            print(f'{key} is not a frame of {job["output_name"]}')
+            return None
+
+        record_rendered_frame(job, frame_number)
+        if not claim_assembly(job):
+            print(f'{prefix} is still rendering or already queued for assembly')
+            return None
+
+        queue_assembly(job, bucket, prefix)
+        return job
+    except Exception as e:
+        print(e)
+        print('Error tracking frame {} in bucket {}.'.format(key, bucket))
+        raise e
+
+
+def is_frame_key(key):
+    name = posixpath.basename(key)
+    return key.startswith(OUTPUT_ROOT) and name not in (JOB_DESCRIPTOR, ARCHIVE_NAME, MANIFEST_NAME)
+
+
+def load_job_descriptor(bucket, prefix):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=prefix + JOB_DESCRIPTOR)
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(response['Body'].read())
+
+
+def parse_frame_number(key, output_name):
+    frame_prefix = output_name + '_'
+    if not key.startswith(frame_prefix):
+        return None
+    frame = posixpath.splitext(key[len(frame_prefix):])[0]
+    return int(frame) if frame.isdigit() else None
+
+
+def progress_key(job, entry):
+    return {'render_job_id': {'S': job['render_job_id']},
+            'progress_key': {'S': entry}}
+
+
+def record_rendered_frame(job, frame_number):
+    """Count the frame towards the job's summary, once per frame number.
+
+    A marker item per frame keeps a frame uploaded twice by a retried render from being counted
+    twice, while every write stays the same small size however many frames the job has.
+    """
+    try:
+        dynamo.transact_write_items(TransactItems=[
+            {'Put': {'TableName': PROGRESS_TABLE,
+                     'Item': progress_key(job, f'frame#{frame_number:05d}'),
+                     'ConditionExpression': 'attribute_not_exists(render_job_id)'}},
+            {'Update': {'TableName': PROGRESS_TABLE,
+                        'Key': progress_key(job, SUMMARY),
+                        'UpdateExpression': 'ADD frames_rendered :one',
+                        'ExpressionAttributeValues': {':one': {'N': '1'}}}}
+        ])
+    except dynamo.exceptions.TransactionCanceledException as e:
+        reasons = e.response.get('CancellationReasons', [])
+        if not any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons):
+            raise
+        print(f'Frame {frame_number} of {job["render_job_id"]} was already counted')
+
+
+def claim_assembly(job):
+    """Mark the job as queued for assembly once every frame is counted.
+
+    Returns False while frames are missing or when another invocation already queued the job.
+    """
+    try:
+        dynamo.update_item(TableName=PROGRESS_TABLE,
+                           Key=progress_key(job, SUMMARY),
+                           UpdateExpression='SET assembly_state = :queued',
+                           ConditionExpression='attribute_not_exists(assembly_state) AND frames_rendered >= :frames',
+                           ExpressionAttributeValues={':queued': {'S': 'queued'},
+                                                      ':frames': {'N': str(job['frames'])}})
+    except dynamo.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def release_assembly(job):
+    dynamo.update_item(TableName=PROGRESS_TABLE,
+                       Key=progress_key(job, SUMMARY),
+                       UpdateExpression='REMOVE assembly_state')
+
+
+def queue_assembly(job, bucket, prefix):
+    try:
+        sqs.send_message(QueueUrl=ASSEMBLY_QUEUE,
+                         MessageBody=json.dumps({'s3_bucket': bucket, 'output_prefix': prefix}))
+    except Exception:
+        # Give the claim back so the retried invocation can queue the job
+        release_assembly(job)
+        raise
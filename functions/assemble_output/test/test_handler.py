@@ -0,0 +1,141 @@
+import pytest
+from moto import mock_s3, mock_dynamodb, mock_sqs
+
+from functions.assemble_output.src.handler import *
+
+OUTPUT_PREFIX = "render-output/default_cube/1970-01-01_00-00-01/12345678/"
+SUMMARY_KEY = {'render_job_id': {'S': '12345678-1234-5678-1234-567812345678'},
+               'progress_key': {'S': 'summary'}}
+
+
+@pytest.fixture
+def set_envs(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_SECURITY_TOKEN", "testing")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+    monkeypatch.setenv("ASSEMBLY_QUEUE", "EXAMPLE-ASSEMBLY-QUEUE")
+
+
+@pytest.fixture(scope="function")
+def s3(set_envs):
+    with mock_s3():
+        bucket_name = "EXAMPLE-BUCKET"
+        s3c = boto3.client("s3")
+        s3c.create_bucket(Bucket=bucket_name)
+        job = {"render_job_id": "12345678-1234-5678-1234-567812345678",
+               "file_name": "default_cube.blend",
+               "frames": 2,
+               "output_name": OUTPUT_PREFIX + "first_render"}
+        s3c.put_object(Bucket=bucket_name, Key=OUTPUT_PREFIX + "job.descriptor", Body=json.dumps(job))
+        yield s3c
+
+
+@pytest.fixture(scope="function")
+def sqs(set_envs):
+    with mock_sqs():
+        sqsc = boto3.client("sqs")
+        sqsc.create_queue(QueueName="EXAMPLE-ASSEMBLY-QUEUE")
+        yield sqsc
+
+
+@pytest.fixture(scope="function")
+def dynamo(set_envs):
+    with mock_dynamodb():
+        dbc = boto3.client("dynamodb", region_name="us-east-1")
+        dbc.create_table(TableName='render_job_progress',
+                         AttributeDefinitions=[
+                             {
+                                 "AttributeName": "render_job_id",
+                                 "AttributeType": "S"
+                             },
+                             {
+                                 "AttributeName": "progress_key",
+                                 "AttributeType": "S"
+                             }
+                         ],
+                         KeySchema=[
+                             {
+                                 "AttributeName": "render_job_id",
+                                 "KeyType": "HASH"
+                             },
+                             {
+                                 "AttributeName": "progress_key",
+                                 "KeyType": "RANGE"
+                             }
+                         ],
+                         ProvisionedThroughput={
+                             "ReadCapacityUnits": 1,
+                             "WriteCapacityUnits": 1
+                         }
+                         )
+        yield dbc
+
+
+def frame_event(frame_number):
+    with open("resources/s3-put-event.json") as file:
+        event = json.load(file)
+    event['Records'][0]['s3']['object']['key'] = OUTPUT_PREFIX + f"first_render_{frame_number:05d}.png"
+    return event
+
+
+def queued_messages(sqs):
+    response = sqs.receive_message(QueueUrl="EXAMPLE-ASSEMBLY-QUEUE", MaxNumberOfMessages=10)
+    return response.get('Messages', [])
+
+
+def test_execute(s3, dynamo, sqs):
+    assert execute(frame_event(1), "") is None
+    assert queued_messages(sqs) == []
+
+    with open("resources/s3-put-event.json") as file:
+        event = json.load(file)
+    job = execute(event, "")
+
+    assert job['frames'] == 2
+    messages = queued_messages(sqs)
+    assert len(messages) == 1
+    assert json.loads(messages[0]['Body']) == {'s3_bucket': 'EXAMPLE-BUCKET', 'output_prefix': OUTPUT_PREFIX}
+    item = dynamo.get_item(TableName='render_job_progress', Key=SUMMARY_KEY)['Item']
+    assert item['assembly_state'] == {'S': 'queued'}
+    assert item['frames_rendered'] == {'N': '2'}
+
+
+def test_execute_counts_repeated_frame_once(s3, dynamo, sqs):
+    assert execute(frame_event(1), "") is None
+    assert execute(frame_event(1), "") is None
+    assert queued_messages(sqs) == []
+    item = dynamo.get_item(TableName='render_job_progress', Key=SUMMARY_KEY)['Item']
+    assert item['frames_rendered'] == {'N': '1'}
+
+
+def test_execute_only_queues_once(s3, dynamo, sqs):
+    execute(frame_event(1), "")
+    assert execute(frame_event(2), "") is not None
+    # A late duplicate upload of the last frame must not queue the job again
+    assert execute(frame_event(2), "") is None
+    assert len(queued_messages(sqs)) == 1
+
+
+def test_execute_ignores_other_outputs(s3, dynamo, sqs):
+    event = frame_event(1)
+    event['Records'][0]['s3']['object']['key'] = OUTPUT_PREFIX + "manifest.json"
+    assert execute(event, "") is None
+
+    event['Records'][0]['s3']['object']['key'] = "render-output/no_job/first_render_00001.png"
+    assert execute(event, "") is None
+
+
+def test_is_frame_key():
+    assert is_frame_key(OUTPUT_PREFIX + "first_render_00001.png")
+    assert not is_frame_key(OUTPUT_PREFIX + "job.descriptor")
+    assert not is_frame_key(OUTPUT_PREFIX + "sequence.tar")
+    assert not is_frame_key(OUTPUT_PREFIX + "manifest.json")
+    assert not is_frame_key("EXAMPLE-PREFIX/example.json")
+
+
+def test_parse_frame_number():
+    output_name = OUTPUT_PREFIX + "first_render"
+    assert parse_frame_number(output_name + "_00012.png", output_name) == 12
+    assert parse_frame_number(output_name + "_extra.png", output_name) is None
+    assert parse_frame_number(OUTPUT_PREFIX + "other_00012.png", output_name) is None
@@ -10,6 +10,9 @@ import os
 
 S3_BUCKET = os.environ['S3_BUCKET']
 SQS_QUEUE = os.environ['SQS_QUEUE']
+# Not .json, so a render request notification filtered on that suffix can't match it
+JOB_DESCRIPTOR = 'job.descriptor'
+OUTPUT_ROOT = 'render-output/'
 
 print('Loading function')
 
@@ -21,6 +24,9 @@ sqs = boto3.client('sqs')
 def execute(event, context):
     bucket = event['Records'][0]['s3']['bucket']['name']
     key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
+    if key.startswith(OUTPUT_ROOT):
+        print(f'Ignoring render output {key}')
+        return None
     try:
         response = s3.get_object(Bucket=bucket, Key=key)
         msg_body = parse_body(response)
@@ -29,6 +35,7 @@ def execute(event, context):
         dynamo.put_item(TableName='render_jobs',
                         Item=create_db_item(msg_body, job_meta))
 
+        put_job_descriptor(job_meta, msg_body)
         put_jobs_on_queue(job_meta, msg_body)
 
         return msg_body
@@ -51,6 +58,17 @@ def put_jobs_on_queue(job_meta, msg_body):
         response.extend(sqs.send_message_batch(Entries=batch, QueueUrl=SQS_QUEUE))
 
 
+def put_job_descriptor(job_meta, msg_body):
+    descriptor = {
+        'render_job_id': str(job_meta.id_db),
+        'file_name': msg_body.file_name,
+        'frames': msg_body.frames,
+        'output_name': job_meta.full_output_path
+    }
+    s3.put_object(Bucket=S3_BUCKET, Key=job_meta.output_prefix + JOB_DESCRIPTOR,
+                  Body=json.dumps(descriptor), ContentType='application/json')
+
+
 def parse_body(response):
     msg_body = SimpleNamespace(** json.loads(response['Body'].read()))
     return msg_body
@@ -60,8 +78,10 @@ def generate_job_meta(file_name, output_name):
     output_name = path_friendly_filename(output_name)
     id_db = uuid.uuid4()
     readable_time = get_time()
-    full_output_path = create_output_path(file_name, id_db, readable_time) + output_name
-    return SimpleNamespace(full_output_path=full_output_path, id_db=id_db, readable_time=readable_time)
+    output_prefix = create_output_path(file_name, id_db, readable_time)
+    full_output_path = output_prefix + output_name
+    return SimpleNamespace(full_output_path=full_output_path, output_prefix=output_prefix, id_db=id_db,
+                           readable_time=readable_time)
 
 
 def get_time():
@@ -117,7 +137,7 @@ def chunks(l, n):
 
 def create_output_path(file_name, id_db, readable_time):
     path_friendly_time = readable_time.replace(' ', '_').replace(':', '-')
-    return f"render-output/{path_friendly_filename(file_name)}/{path_friendly_time}/{str(id_db)[0:8]}/"
+    return f"{OUTPUT_ROOT}{path_friendly_filename(file_name)}/{path_friendly_time}/{str(id_db)[0:8]}/"
 
 
 def path_friendly_filename(file_name):
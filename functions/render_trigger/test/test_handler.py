@@ -101,6 +101,21 @@ def test_execute(s3, dynamo, sqs, patch_time, patch_uuid):
     assert result.frames == 1
     assert result.output_name == "first_render"
 
+    descriptor_response = s3.get_object(
+        Bucket='EXAMPLE-BUCKET',
+        Key='render-output/test/default_cube/1970-01-01_00-00-01/12345678/job.descriptor')
+    descriptor = json.loads(descriptor_response['Body'].read())
+    assert descriptor['frames'] == 1
+    assert descriptor['output_name'] == 'render-output/test/default_cube/1970-01-01_00-00-01/12345678/first_render'
+
+
+def test_execute_ignores_render_output():
+    with open("resources/s3-put-event.json") as file:
+        event = json.load(file)
+    event['Records'][0]['s3']['object']['key'] = 'render-output/test/default_cube/1970-01-01_00-00-01/12345678/manifest.json'
+
+    assert execute(event, "") is None
+
 
 def test_get_time(patch_time):
     actual_result = get_time()
@@ -114,6 +129,7 @@ def test_generate_job_meta(patch_time, patch_uuid):
     expected_id_db = UUID('12345678-1234-5678-1234-567812345678')
     expected_readable_time = "1970-01-01 00:00:01"
     assert actual_result.full_output_path == expected_full_output
+    assert actual_result.output_prefix == 'render-output/somefile/1970-01-01_00-00-01/12345678/'
     assert actual_result.id_db == expected_id_db
     assert actual_result.readable_time == expected_readable_time
 
@@ -0,0 +1,282 @@
+"""Streams a finished render job's frames into one tar archive and writes a manifest describing it.
+
+Jobs are queued on ASSEMBLY_QUEUE by the assemble_output Lambda once every frame is rendered. A
+message is only deleted once its archive and manifest are written, so failed assemblies are retried
+by SQS. A worker killed mid-upload leaves an incomplete multipart upload behind: the next attempt
+aborts it, and the bucket should also carry an AbortIncompleteMultipartUpload lifecycle rule on
+render-output/ for jobs that are never retried.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import tarfile
+import time
+
+import boto3
+import logging
+
+from botocore.exceptions import ClientError
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+JOB_DESCRIPTOR = 'job.descriptor'
+ARCHIVE_NAME = 'sequence.tar'
+MANIFEST_NAME = 'manifest.json'
+DEFAULT_PART_SIZE = 8 * 1024 * 1024  # smallest part we upload, above S3's 5 MiB minimum
+MAX_PARTS = 10000
+MAX_OBJECT_SIZE = 5 * 1024 ** 4
+# Headers plus padding per member, and the end-of-archive blocks padded to a full record, with headroom
+TAR_MEMBER_OVERHEAD = 8 * tarfile.BLOCKSIZE
+TAR_END_OVERHEAD = 2 * tarfile.RECORDSIZE
+VISIBILITY_TIMEOUT = 300
+VISIBILITY_EXTEND_INTERVAL = 60
+
+
+def ensure_envvars():
+    """Ensure that these environment variables are provided at runtime"""
+    required_envvars = [
+        "AWS_REGION",
+        "ASSEMBLY_QUEUE"
+    ]
+
+    missing_envvars = []
+    for required_envvar in required_envvars:
+        if not os.environ.get(required_envvar, ''):
+            missing_envvars.append(required_envvar)
+
+    if missing_envvars:
+        message = "Required environment variables are missing: " + \
+                  repr(missing_envvars)
+        raise AssertionError(message)
+
+
+class VisibilityHeartbeat:
+    """Keeps an SQS message hidden from other workers while its job is still being assembled"""
+
+    def __init__(self, sqs, receipt_handle):
+        self.sqs = sqs
+        self.receipt_handle = receipt_handle
+        self.last_extended = time.monotonic()
+
+    def beat(self):
+        if time.monotonic() - self.last_extended < VISIBILITY_EXTEND_INTERVAL:
+            return
+        self.sqs.change_message_visibility(QueueUrl=os.environ["ASSEMBLY_QUEUE"],
+                                           ReceiptHandle=self.receipt_handle,
+                                           VisibilityTimeout=VISIBILITY_TIMEOUT)
+        self.last_extended = time.monotonic()
+
+
+class HashingReader:
+    """Wraps a streaming body and hashes the bytes as tarfile reads them"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+class MultipartUploadWriter:
+    """File-like sink that ships buffered bytes to S3 as multipart upload parts.
+
+    Only one part is held in memory at a time, so the archive never touches local disk.
+    """
+
+    def __init__(self, s3, bucket, key, part_size=DEFAULT_PART_SIZE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+
+    def __enter__(self):
+        response = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                   ContentType='application/x-tar')
+        self.upload_id = response['UploadId']
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            return False
+        if self.buffer or not self.parts:
+            self._upload_part(bytes(self.buffer))
+        self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                          MultipartUpload={'Parts': self.parts})
+        return False
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(memoryview(self.buffer)[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def _upload_part(self, data):
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                       PartNumber=part_number, Body=data)
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+
+def object_exists(s3, bucket, key):
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=key, MaxKeys=1)
+    return any(obj['Key'] == key for obj in response.get('Contents', []))
+
+
+def load_job_descriptor(s3, bucket, prefix):
+    response = s3.get_object(Bucket=bucket, Key=prefix + JOB_DESCRIPTOR)
+    return json.loads(response['Body'].read())
+
+
+def list_frames(s3, bucket, output_name):
+    frames = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=output_name + '_'):
+        frames.extend(page.get('Contents', []))
+    return sorted(frames, key=lambda frame: frame['Key'])
+
+
+def choose_part_size(frames):
+    """Pick a part size that keeps the whole archive within S3's 10,000 part limit"""
+    archive_size = sum(frame['Size'] + TAR_MEMBER_OVERHEAD for frame in frames) + TAR_END_OVERHEAD
+    if archive_size > MAX_OBJECT_SIZE:
+        raise ValueError(f"Archive of about {archive_size} bytes exceeds the S3 object size limit")
+    part_size = max(DEFAULT_PART_SIZE, -(-archive_size // MAX_PARTS))
+    mebibyte = 1024 * 1024
+    return -(-part_size // mebibyte) * mebibyte
+
+
+def abort_stale_uploads(s3, bucket, key):
+    """Abort uploads of this archive left behind by a worker that died mid-assembly"""
+    response = s3.list_multipart_uploads(Bucket=bucket, Prefix=key)
+    for upload in response.get('Uploads', []):
+        if upload['Key'] == key:
+            logger.info(f"Aborting stale upload {upload['UploadId']} of {key}")
+            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload['UploadId'])
+
+
+def assemble_job(s3, bucket, prefix, heartbeat=None):
+    """Assemble the job under prefix, returning its manifest or None when it was already assembled"""
+    if object_exists(s3, bucket, prefix + MANIFEST_NAME):
+        logger.info(f"Output under {prefix} is already assembled")
+        return None
+
+    job = load_job_descriptor(s3, bucket, prefix)
+    frames = list_frames(s3, bucket, job['output_name'])
+    if len(frames) < job['frames']:
+        raise ValueError(f"Only {len(frames)} of {job['frames']} frames found under {prefix}")
+
+    archive_key = prefix + ARCHIVE_NAME
+    abort_stale_uploads(s3, bucket, archive_key)
+    manifest_frames = []
+    part_size = choose_part_size(frames)
+    with MultipartUploadWriter(s3, bucket, archive_key, part_size) as writer:
+        with tarfile.open(fileobj=writer, mode='w|', format=tarfile.PAX_FORMAT) as archive:
+            for frame in frames:
+                manifest_frames.append(add_frame_to_archive(s3, archive, bucket, frame['Key']))
+                if heartbeat:
+                    heartbeat.beat()
+
+    manifest = create_manifest(job, archive_key, manifest_frames)
+    s3.put_object(Bucket=bucket, Key=prefix + MANIFEST_NAME, Body=json.dumps(manifest, indent=2),
+                  ContentType='application/json')
+    return manifest
+
+
+def add_frame_to_archive(s3, archive, bucket, frame_key):
+    response = s3.get_object(Bucket=bucket, Key=frame_key)
+    tar_info = tarfile.TarInfo(name=posixpath.basename(frame_key))
+    tar_info.size = response['ContentLength']
+    tar_info.mtime = int(response['LastModified'].timestamp())
+
+    # The frame's bytes start right after its header, so clients can range-read it out of the archive
+    header_size = len(tar_info.tobuf(archive.format, archive.encoding, archive.errors))
+    offset = archive.offset + header_size
+
+    body = HashingReader(response['Body'])
+    archive.addfile(tar_info, body)
+
+    render_seconds = response.get('Metadata', {}).get('render-seconds')
+    return {
+        'key': frame_key,
+        'name': tar_info.name,
+        'size': tar_info.size,
+        'sha256': body.hexdigest(),
+        'archive_offset': offset,
+        'render_seconds': float(render_seconds) if render_seconds is not None else None
+    }
+
+
+def create_manifest(job, archive_key, frames):
+    return {
+        'render_job_id': job['render_job_id'],
+        'file_name': job['file_name'],
+        'frame_count': len(frames),
+        'archive': archive_key,
+        'frames': frames
+    }
+
+
+def process_message(message, s3, sqs):
+    body = json.loads(message['Body'])
+    logger.info(f"Assembling {body['output_prefix']} in {body['s3_bucket']}")
+    heartbeat = VisibilityHeartbeat(sqs, message['ReceiptHandle'])
+    assemble_job(s3, body['s3_bucket'], body['output_prefix'], heartbeat)
+    sqs.delete_message(QueueUrl=os.environ["ASSEMBLY_QUEUE"], ReceiptHandle=message['ReceiptHandle'])
+
+
+def get_messages(sqs):
+    logger.info(f"SQS Consumer starting for : {os.environ['ASSEMBLY_QUEUE']}")
+    try:
+        response = sqs.receive_message(
+            QueueUrl=os.environ["ASSEMBLY_QUEUE"],
+            MaxNumberOfMessages=1,
+            VisibilityTimeout=VISIBILITY_TIMEOUT,
+            WaitTimeSeconds=1
+        )
+    except ClientError as error:
+        logger.exception("Couldn't receive messages from queue: %s", os.environ["ASSEMBLY_QUEUE"])
+        raise error
+    else:
+        return response
+
+
+def get_aws_clients():
+    s3 = boto3.client("s3")
+    sqs = boto3.client("sqs")
+    return s3, sqs
+
+
+def main():
+    logger.info("Assemble Worker starting ...")
+
+    try:
+        ensure_envvars()
+    except AssertionError as e:
+        logger.error(str(e))
+        raise
+
+    s3, sqs = get_aws_clients()
+    response = get_messages(sqs)
+    for message in response.get('Messages', []):
+        # Failures leave the message on the queue, so SQS retries the assembly
+        try:
+            process_message(message, s3, sqs)
+        except Exception as e:
+            logger.error(f"Exception while assembling message {message['MessageId']}: {repr(e)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import hashlib
+import io
+import json
+import tarfile
+
+import boto3
+import pytest
+from moto import mock_s3, mock_sqs
+
+from assemble_worker import ensure_envvars, assemble_job, MultipartUploadWriter, process_message, object_exists, \
+    choose_part_size, DEFAULT_PART_SIZE, MAX_PARTS
+
+OUTPUT_PREFIX = "render-output/default_cube/1970-01-01_00-00-01/12345678/"
+
+
+@pytest.fixture
+def set_envs(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_SECURITY_TOKEN", "testing")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    monkeypatch.setenv("ASSEMBLY_QUEUE", "EXAMPLE-ASSEMBLY-QUEUE")
+
+
+@pytest.fixture(scope="function")
+def s3(set_envs):
+    with mock_s3():
+        bucket_name = "EXAMPLE-BUCKET"
+        s3c = boto3.client("s3")
+        s3c.create_bucket(Bucket=bucket_name)
+        job = {"render_job_id": "12345678-1234-5678-1234-567812345678",
+               "file_name": "default_cube.blend",
+               "frames": 2,
+               "output_name": OUTPUT_PREFIX + "first_render"}
+        s3c.put_object(Bucket=bucket_name, Key=OUTPUT_PREFIX + "job.descriptor", Body=json.dumps(job))
+        s3c.put_object(Bucket=bucket_name, Key=OUTPUT_PREFIX + "first_render_00001.png", Body=b"frame one",
+                       Metadata={"render-seconds": "1.250"})
+        yield s3c
+
+
+@pytest.fixture(scope="function")
+def sqs(set_envs):
+    with mock_sqs():
+        sqsc = boto3.client("sqs")
+        sqsc.create_queue(QueueName="EXAMPLE-ASSEMBLY-QUEUE")
+        sqsc.send_message(QueueUrl="EXAMPLE-ASSEMBLY-QUEUE",
+                          MessageBody=json.dumps({"s3_bucket": "EXAMPLE-BUCKET", "output_prefix": OUTPUT_PREFIX}))
+        yield sqsc
+
+
+def put_second_frame(s3c):
+    s3c.put_object(Bucket="EXAMPLE-BUCKET", Key=OUTPUT_PREFIX + "first_render_00002.png", Body=b"frame two!",
+                   Metadata={"render-seconds": "2.500"})
+
+
+def test_ensure_envvars(set_envs):
+    ensure_envvars()
+
+
+def test_assemble_job(s3):
+    put_second_frame(s3)
+
+    manifest = assemble_job(s3, "EXAMPLE-BUCKET", OUTPUT_PREFIX)
+
+    assert manifest["frame_count"] == 2
+    assert manifest["archive"] == OUTPUT_PREFIX + "sequence.tar"
+    stored_manifest = json.loads(
+        s3.get_object(Bucket="EXAMPLE-BUCKET", Key=OUTPUT_PREFIX + "manifest.json")["Body"].read())
+    assert stored_manifest == manifest
+
+    archive_bytes = s3.get_object(Bucket="EXAMPLE-BUCKET", Key=manifest["archive"])["Body"].read()
+    with tarfile.open(fileobj=io.BytesIO(archive_bytes)) as archive:
+        assert archive.getnames() == ["first_render_00001.png", "first_render_00002.png"]
+
+    second = manifest["frames"][1]
+    assert second["key"] == OUTPUT_PREFIX + "first_render_00002.png"
+    assert second["size"] == 10
+    assert second["sha256"] == hashlib.sha256(b"frame two!").hexdigest()
+    assert second["render_seconds"] == 2.5
+    ranged = s3.get_object(Bucket="EXAMPLE-BUCKET", Key=manifest["archive"],
+                           Range=f"bytes={second['archive_offset']}-{second['archive_offset'] + second['size'] - 1}")
+    assert ranged["Body"].read() == b"frame two!"
+
+
+def test_assemble_job_long_output_name(s3):
+    long_prefix = OUTPUT_PREFIX.replace("12345678", "87654321")
+    output_name = long_prefix + "a_very_long_output_name_" * 6
+    job = {"render_job_id": "87654321-1234-5678-1234-567812345678",
+           "file_name": "default_cube.blend",
+           "frames": 1,
+           "output_name": output_name}
+    s3.put_object(Bucket="EXAMPLE-BUCKET", Key=long_prefix + "job.descriptor", Body=json.dumps(job))
+    s3.put_object(Bucket="EXAMPLE-BUCKET", Key=output_name + "_00001.png", Body=b"long frame")
+
+    manifest = assemble_job(s3, "EXAMPLE-BUCKET", long_prefix)
+
+    frame = manifest["frames"][0]
+    assert len(frame["name"]) > 100
+    ranged = s3.get_object(Bucket="EXAMPLE-BUCKET", Key=manifest["archive"],
+                           Range=f"bytes={frame['archive_offset']}-{frame['archive_offset'] + frame['size'] - 1}")
+    assert ranged["Body"].read() == b"long frame"
+
+
+def test_assemble_job_skips_assembled_output(s3):
+    put_second_frame(s3)
+    assert assemble_job(s3, "EXAMPLE-BUCKET", OUTPUT_PREFIX) is not None
+    assert assemble_job(s3, "EXAMPLE-BUCKET", OUTPUT_PREFIX) is None
+
+
+def test_assemble_job_missing_frames(s3):
+    with pytest.raises(ValueError):
+        assemble_job(s3, "EXAMPLE-BUCKET", OUTPUT_PREFIX)
+    assert not object_exists(s3, "EXAMPLE-BUCKET", OUTPUT_PREFIX + "manifest.json")
+
+
+def test_assemble_job_aborts_stale_upload(s3):
+    put_second_frame(s3)
+    s3.create_multipart_upload(Bucket="EXAMPLE-BUCKET", Key=OUTPUT_PREFIX + "sequence.tar")
+
+    assemble_job(s3, "EXAMPLE-BUCKET", OUTPUT_PREFIX)
+
+    assert s3.list_multipart_uploads(Bucket="EXAMPLE-BUCKET").get("Uploads", []) == []
+
+
+def test_process_message(s3, sqs):
+    put_second_frame(s3)
+    message = sqs.receive_message(QueueUrl="EXAMPLE-ASSEMBLY-QUEUE")["Messages"][0]
+
+    process_message(message, s3, sqs)
+
+    assert object_exists(s3, "EXAMPLE-BUCKET", OUTPUT_PREFIX + "manifest.json")
+    attributes = sqs.get_queue_attributes(QueueUrl="EXAMPLE-ASSEMBLY-QUEUE",
+                                          AttributeNames=["ApproximateNumberOfMessagesNotVisible"])
+    assert attributes["Attributes"]["ApproximateNumberOfMessagesNotVisible"] == "0"
+
+
+def test_choose_part_size():
+    assert choose_part_size([{"Size": 1024}] * 10) == DEFAULT_PART_SIZE
+
+    frames = [{"Size": 50 * 1024 * 1024}] * 4000
+    part_size = choose_part_size(frames)
+    assert part_size > DEFAULT_PART_SIZE
+    assert part_size % (1024 * 1024) == 0
+    assert part_size * MAX_PARTS >= sum(frame["Size"] for frame in frames)
+
+
+def test_choose_part_size_too_large():
+    with pytest.raises(ValueError):
+        choose_part_size([{"Size": 5 * 1024 ** 4}])
+
+
+def test_multipart_upload_writer_splits_parts(s3):
+    with MultipartUploadWriter(s3, "EXAMPLE-BUCKET", "some/key", part_size=5 * 1024 * 1024) as writer:
+        writer.write(b"a" * (5 * 1024 * 1024 + 3))
+        assert len(writer.parts) == 1
+    assert len(writer.parts) == 2
+    body = s3.get_object(Bucket="EXAMPLE-BUCKET", Key="some/key")["Body"].read()
+    assert len(body) == 5 * 1024 * 1024 + 3
@@ -1,11 +1,12 @@
+import argparse
 import glob
 import json
 import os
 import re
 import subprocess
+import time
 from types import SimpleNamespace
 
-import boto3
 import logging
 
 from botocore.exceptions import ClientError
@@ -13,6 +14,58 @@ from botocore.exceptions import ClientError
 logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
+DEFAULT_CACHE_DIR = "/var/cache/render-worker"
+GPU_PROBE_FILE = "gpu_probe.json"
+CUDA_CACHE_MAXSIZE = str(4 * 1024 ** 3)  # the driver's upper limit, its default is far too small for Cycles
+
+
+def process_start_time(proc_dir="/proc"):
+    """Return when this process started, on the time.perf_counter() clock.
+
+    Falls back to the current time where /proc is not available, e.g. outside Linux.
+    """
+    now = time.perf_counter()
+    try:
+        with open(os.path.join(proc_dir, "self/stat")) as file:
+            # The command name may contain spaces, so split after its closing parenthesis
+            fields = file.read().rsplit(")", 1)[1].split()
+        with open(os.path.join(proc_dir, "uptime")) as file:
+            uptime = float(file.read().split()[0])
+        started_after_boot = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return now
+    return now - max(uptime - started_after_boot, 0.0)
+
+
+class StartupProfile:
+    """Records how long each startup phase took, measured from when the process started.
+
+    A disabled profile records nothing, so it costs nothing to pass around.
+    """
+
+    def __init__(self, enabled=False, start=None):
+        if enabled and start is None:
+            start = process_start_time()
+        self.enabled = enabled
+        self.start = start
+        self.last = start
+        self.phases = []
+
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        logger.info("Startup profile:")
+        for phase, seconds in self.phases:
+            logger.info(f"  {phase:<20} {seconds:8.3f}s")
+        logger.info(f"  {'total':<20} {self.last - self.start:8.3f}s")
+
 
 def ensure_envvars():
     """Ensure that these environment variables are provided at runtime"""
@@ -33,15 +86,19 @@ def ensure_envvars():
         raise AssertionError(message)
 
 
-def put_render_in_s3(instruction, s3):
+def put_render_in_s3(instruction, s3, render_seconds=None):
     current_dir = os.getcwd()
     try:
-        path = f"{current_dir}\\output_file_*"
+        path = os.path.join(current_dir, "output_file_*")
         for filename in glob.glob(path):
             f_name, extension = os.path.splitext(filename)
             output_with_extension = instruction.object_name + extension
-            with open(filename, "rb") as test_blend:
-                s3.put_object(Bucket=instruction.s3_bucket, Key=output_with_extension, Body=filename)
+            metadata = {}
+            if render_seconds is not None:
+                metadata['render-seconds'] = f"{render_seconds:.3f}"
+            with open(filename, "rb") as rendered_file:
+                s3.put_object(Bucket=instruction.s3_bucket, Key=output_with_extension, Body=rendered_file,
+                              Metadata=metadata)
     except ClientError as err:
         deal_with_error(err)
 
@@ -54,7 +111,7 @@ def create_blender_command(instruction, gpu_script_path, gpu_flag, gpu_name):
         gpu_script = gpu_script_path + gpu_script
     base_command = [blender_path,
                     "-b", "file.blend",
-                    "-o", f"{current_dir}\\output_file_",
+                    "-o", os.path.join(current_dir, "output_file_"),
                     "-P", gpu_script,
                     "-f", str(instruction.render_frame)]
     if gpu_flag:
@@ -109,11 +166,65 @@ def use_gpu():
         return False, None
 
 
-def process_instruction(gpu_flag, gpu_name, instruction, s3):
+def get_cache_dir():
+    return os.environ.get("WORKER_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+def gpu_probe_key(proc_dir="/proc", dev_dir="/dev"):
+    """Identify the boot, NVIDIA driver and GPUs visible to this task, or return None when no GPU is passed through.
+
+    Tasks sharing the cache volume on one host may each be given different GPUs, so the visible devices
+    are part of the key as well as the boot and driver.
+    """
+    if not os.path.exists(os.path.join(dev_dir, "nvidia0")):
+        return None
+    try:
+        with open(os.path.join(proc_dir, "sys/kernel/random/boot_id")) as file:
+            boot_id = file.read().strip()
+        with open(os.path.join(proc_dir, "driver/nvidia/version")) as file:
+            driver_version = file.read().strip()
+        gpus = sorted(os.listdir(os.path.join(proc_dir, "driver/nvidia/gpus")))
+    except OSError:
+        return None
+    visible_devices = os.environ.get("NVIDIA_VISIBLE_DEVICES", "")
+    return "\n".join([boot_id, driver_version, ",".join(gpus), visible_devices])
+
+
+def use_cached_gpu(cache_dir):
+    """Reuse the GPU found by a previous worker on this boot and driver instead of running nvidia-smi again"""
+    probe_file = os.path.join(cache_dir, GPU_PROBE_FILE)
+    probe_key = gpu_probe_key()
+    if probe_key is not None:
+        try:
+            with open(probe_file) as file:
+                cached_probe = json.load(file)
+            if cached_probe['key'] == probe_key:
+                return True, cached_probe['gpu_name']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    gpu_flag, gpu_name = use_gpu()
+    # Only a detected GPU is cached, so a failed probe is retried on the next start
+    if gpu_flag and probe_key is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(probe_file, "w") as file:
+                json.dump({'key': probe_key, 'gpu_name': gpu_name}, file)
+        except OSError as e:
+            logger.warning(f"Couldn't cache GPU probe in {cache_dir}: {e}")
+    return gpu_flag, gpu_name
+
+
+def process_instruction(gpu_flag, gpu_name, instruction, s3, profile=None):
+    profile = profile or StartupProfile()
     save_blend_file_locally(instruction, s3)
+    profile.mark("download blend")
     blender_cmd = create_blender_command(instruction, None, gpu_flag, gpu_name)
+    render_start = time.monotonic()
     render_frame(blender_cmd)
-    put_render_in_s3(instruction, s3)
+    profile.mark("render frame")
+    put_render_in_s3(instruction, s3, time.monotonic() - render_start)
+    profile.mark("upload frame")
 
 
 def extract_instruction(message):
@@ -164,10 +275,10 @@ def get_messages(sqs):
         return response
 
 
-def get_aws_clients():
-    s3 = boto3.resource("s3")
-    sqs = boto3.client("sqs")
-    return s3, sqs
+def get_aws_client(service_name):
+    # boto3 is imported here so its import cost is only paid once the environment is known to be valid
+    import boto3
+    return boto3.client(service_name)
 
 
 def deal_with_error(err):
@@ -179,23 +290,57 @@ def deal_with_error(err):
         raise err
 
 
-def main():
-    logger.info("Render Worker starting ...")
+def set_kernel_cache_envvars(cache_dir):
+    """Keep the driver's PTX compile cache and the OptiX module cache on the persistent volume.
+
+    Blender inherits these, so GPU kernels compiled by one task are reused by the next one. Values
+    an operator has already set win.
+    """
+    os.environ.setdefault("CUDA_CACHE_PATH", os.path.join(cache_dir, "nv"))
+    os.environ.setdefault("CUDA_CACHE_MAXSIZE", CUDA_CACHE_MAXSIZE)
+    os.environ.setdefault("OPTIX_CACHE_PATH", os.path.join(cache_dir, "optix"))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render frames pulled from the render queue")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="log a timing breakdown from process start to the first uploaded frame")
+    return parser.parse_args(argv)
 
-    s3, sqs = get_aws_clients()
+
+def main(argv=None):
+    args = parse_args(argv)
+    profile = StartupProfile(enabled=args.startup_profile)
+    profile.mark("interpreter + imports")
+    logger.info("Render Worker starting ...")
 
     try:
         ensure_envvars()
     except AssertionError as e:
         logger.error(str(e))
         raise
+    profile.mark("env validation")
+
+    cache_dir = get_cache_dir()
+    set_kernel_cache_envvars(cache_dir)
+
+    sqs = get_aws_client("sqs")
+    profile.mark("sqs client")
 
     response = get_messages(sqs)
-    instructions = extract_instructions_from_messages(response['Messages'], sqs)
+    instructions = extract_instructions_from_messages(response.get('Messages', []), sqs)
+    profile.mark("receive messages")
     if instructions:
-        gpu_flag, gpu_name = use_gpu()
+        s3 = get_aws_client("s3")
+        profile.mark("s3 client")
+        gpu_flag, gpu_name = use_cached_gpu(cache_dir)
+        profile.mark("gpu probe")
         for instruction in instructions:
-            process_instruction(gpu_flag, gpu_name, instruction, s3)
+            process_instruction(gpu_flag, gpu_name, instruction, s3, profile)
+            profile.report()
+            profile = StartupProfile()
+    else:
+        profile.report()
 
 
 if __name__ == "__main__":
@@ -1,13 +1,17 @@
 import json
+import logging
 import os
+import time
 from types import SimpleNamespace
 
 import boto3
 import pytest
 from moto import mock_s3, mock_sqs
 
+import render_worker
 from render_worker import ensure_envvars, get_messages, extract_instructions_from_messages, extract_instruction, \
-    render_frame, create_blender_command, use_gpu, process_instruction
+    render_frame, create_blender_command, use_gpu, process_instruction, use_cached_gpu, parse_args, StartupProfile, \
+    set_kernel_cache_envvars, process_start_time, main
 
 
 @pytest.fixture
@@ -67,7 +71,7 @@ def test_process_instruction(s3, sample_render_instruction, fp):
     # Mock subprocess
     current_dir = os.getcwd()
     default_blender = "/bin/blender/3.6.2/blender"
-    blender_command = [default_blender, "-b", "file.blend", "-o", f"{current_dir}\\output_file_",
+    blender_command = [default_blender, "-b", "file.blend", "-o", os.path.join(current_dir, "output_file_"),
                        "-P", "render_with_gpu.py", "-f", "3"]
     fp.register(blender_command)
 
@@ -78,11 +82,13 @@ def test_process_instruction(s3, sample_render_instruction, fp):
 
     process_instruction(False, None, sample_render_instruction, s3)
 
-    # Assert output is written back to bucket
-    s3.get_object(
+    # Assert output is written back to bucket with its render time
+    response = s3.get_object(
         Bucket='EXAMPLE-BUCKET',
         Key='some/fake/path_00003.png'
     )
+    assert response['Body'].read() == b'fake file'
+    assert float(response['Metadata']['render-seconds']) >= 0
 
     # delete files created during this test
     os.remove('file.blend')
@@ -93,7 +99,7 @@ def test_render_frame(fp):
     # Mock subprocess
     current_dir = os.getcwd()
     default_blender = "/bin/blender/3.6.2/blender"
-    blender_command = [default_blender, "-b", "file.blend", "-o", f"{current_dir}\\output_file_",
+    blender_command = [default_blender, "-b", "file.blend", "-o", os.path.join(current_dir, "output_file_"),
                        "-P", "render_with_gpu.py", "-f", "3"]
     fp.register(blender_command)
 
@@ -115,6 +121,192 @@ def test_use_gpu_fails(fp):
     assert gpu_name is None
 
 
+@pytest.fixture
+def patch_gpu_probe_key(monkeypatch):
+    probe_key = {"value": "boot-1\ndriver-535"}
+    monkeypatch.setattr(render_worker, "gpu_probe_key", lambda: probe_key["value"])
+    return probe_key
+
+
+def test_use_cached_gpu(fp, tmp_path, patch_gpu_probe_key):
+    fp.register(['nvidia-smi', '-L'],
+                stdout=["GPU 0: RTX 4060 (UUID: GPU-123) GPU 1: GTX 1060 (UUID: GPU-456)"])
+    assert use_cached_gpu(str(tmp_path)) == (True, 'RTX 4060')
+
+    # nvidia-smi is only registered once, so a second probe would fail
+    assert use_cached_gpu(str(tmp_path)) == (True, 'RTX 4060')
+    assert fp.call_count(['nvidia-smi', '-L']) == 1
+
+
+def test_use_cached_gpu_reprobes_when_key_changes(fp, tmp_path, patch_gpu_probe_key):
+    fp.register(['nvidia-smi', '-L'], stdout=["GPU 0: RTX 4060 (UUID: GPU-123)"])
+    fp.register(['nvidia-smi', '-L'], stdout=["GPU 0: RTX 4090 (UUID: GPU-789)"])
+    assert use_cached_gpu(str(tmp_path)) == (True, 'RTX 4060')
+
+    patch_gpu_probe_key["value"] = "boot-1\ndriver-550"
+    assert use_cached_gpu(str(tmp_path)) == (True, 'RTX 4090')
+    assert fp.call_count(['nvidia-smi', '-L']) == 2
+
+
+def test_use_cached_gpu_ignores_cache_without_gpu_device(fp, tmp_path, patch_gpu_probe_key):
+    fp.register(['nvidia-smi', '-L'], stdout=["GPU 0: RTX 4060 (UUID: GPU-123)"])
+    assert use_cached_gpu(str(tmp_path)) == (True, 'RTX 4060')
+
+    patch_gpu_probe_key["value"] = None
+    fp.register(['nvidia-smi', '-L'], returncode=1)
+    assert use_cached_gpu(str(tmp_path)) == (False, None)
+
+
+@pytest.fixture
+def fake_nvidia_host(tmp_path, monkeypatch):
+    proc_dir = tmp_path / "proc"
+    dev_dir = tmp_path / "dev"
+    (proc_dir / "sys/kernel/random").mkdir(parents=True)
+    (proc_dir / "sys/kernel/random/boot_id").write_text("boot-1\n")
+    (proc_dir / "driver/nvidia/gpus/0000:01:00.0").mkdir(parents=True)
+    (proc_dir / "driver/nvidia/gpus/0000:02:00.0").mkdir(parents=True)
+    (proc_dir / "driver/nvidia/version").write_text("NVRM version: 535.104.05\n")
+    dev_dir.mkdir()
+    (dev_dir / "nvidia0").touch()
+    monkeypatch.setenv("NVIDIA_VISIBLE_DEVICES", "0")
+    return str(proc_dir), str(dev_dir)
+
+
+def test_gpu_probe_key(fake_nvidia_host, monkeypatch):
+    proc_dir, dev_dir = fake_nvidia_host
+    key = render_worker.gpu_probe_key(proc_dir, dev_dir)
+    assert key is not None
+
+    # Only the devices handed to this task change
+    monkeypatch.setenv("NVIDIA_VISIBLE_DEVICES", "1")
+    assert render_worker.gpu_probe_key(proc_dir, dev_dir) != key
+
+    monkeypatch.setenv("NVIDIA_VISIBLE_DEVICES", "0")
+    os.rmdir(os.path.join(proc_dir, "driver/nvidia/gpus/0000:02:00.0"))
+    assert render_worker.gpu_probe_key(proc_dir, dev_dir) != key
+
+    os.remove(os.path.join(dev_dir, "nvidia0"))
+    assert render_worker.gpu_probe_key(proc_dir, dev_dir) is None
+
+
+def test_use_cached_gpu_reprobes_when_visible_devices_change(fp, tmp_path, fake_nvidia_host, monkeypatch):
+    proc_dir, dev_dir = fake_nvidia_host
+    probe_key = render_worker.gpu_probe_key
+    monkeypatch.setattr(render_worker, "gpu_probe_key", lambda: probe_key(proc_dir, dev_dir))
+    cache_dir = str(tmp_path / "cache")
+    fp.register(['nvidia-smi', '-L'], stdout=["GPU 0: RTX 4060 (UUID: GPU-123)"])
+    fp.register(['nvidia-smi', '-L'], stdout=["GPU 0: GTX 1060 (UUID: GPU-456)"])
+    assert use_cached_gpu(cache_dir) == (True, 'RTX 4060')
+
+    monkeypatch.setenv("NVIDIA_VISIBLE_DEVICES", "1")
+    assert use_cached_gpu(cache_dir) == (True, 'GTX 1060')
+    assert fp.call_count(['nvidia-smi', '-L']) == 2
+
+
+def test_use_cached_gpu_does_not_cache_failure(fp, tmp_path, patch_gpu_probe_key):
+    fp.register(['nvidia-smi', '-L'], returncode=1)
+    assert use_cached_gpu(str(tmp_path)) == (False, None)
+    assert not (tmp_path / "gpu_probe.json").exists()
+
+
+def test_parse_args():
+    assert not parse_args([]).startup_profile
+    assert parse_args(["--startup-profile"]).startup_profile
+
+
+def test_set_kernel_cache_envvars(monkeypatch):
+    monkeypatch.delenv("CUDA_CACHE_PATH", raising=False)
+    monkeypatch.delenv("CUDA_CACHE_MAXSIZE", raising=False)
+    monkeypatch.setenv("OPTIX_CACHE_PATH", "/somewhere/else")
+
+    set_kernel_cache_envvars("/cache")
+
+    assert os.environ["CUDA_CACHE_PATH"] == "/cache/nv"
+    assert os.environ["CUDA_CACHE_MAXSIZE"] == "4294967296"
+    assert os.environ["OPTIX_CACHE_PATH"] == "/somewhere/else"
+
+
+def test_process_start_time(tmp_path):
+    # The process started 95s after boot and the machine has been up for 100s
+    ticks = 95 * os.sysconf("SC_CLK_TCK")
+    (tmp_path / "self").mkdir()
+    (tmp_path / "self/stat").write_text("1234 (render worker) S " + "0 " * 18 + f"{ticks} " + "0 " * 10)
+    (tmp_path / "uptime").write_text("100.00 50.00\n")
+
+    start = process_start_time(str(tmp_path))
+    elapsed = time.perf_counter() - start
+
+    assert 4.9 < elapsed < 5.5
+
+
+def test_process_start_time_without_proc(tmp_path):
+    start = process_start_time(str(tmp_path / "missing"))
+    elapsed = time.perf_counter() - start
+    assert 0 <= elapsed < 0.5
+
+
+def test_startup_profile(caplog):
+    caplog.set_level(logging.INFO)
+    profile = StartupProfile(enabled=True, start=time.perf_counter())
+    profile.mark("imports")
+    profile.mark("env validation")
+    profile.report()
+
+    assert [phase for phase, seconds in profile.phases] == ["imports", "env validation"]
+    report = caplog.text
+    assert "imports" in report
+    assert "env validation" in report
+    assert "total" in report
+
+
+def test_startup_profile_disabled(caplog):
+    caplog.set_level(logging.INFO)
+    profile = StartupProfile()
+    profile.mark("imports")
+    profile.report()
+
+    assert profile.phases == []
+    assert "Startup profile" not in caplog.text
+
+
+def test_main_validates_env_before_building_clients(set_envs, monkeypatch):
+    monkeypatch.delenv("SQS_QUEUE")
+    built_clients = []
+    monkeypatch.setattr(render_worker, "get_aws_client", built_clients.append)
+
+    with pytest.raises(AssertionError):
+        main([])
+    assert built_clients == []
+
+
+def test_main_startup_profile(s3, sqs, fp, tmp_path, monkeypatch, caplog):
+    caplog.set_level(logging.INFO)
+    monkeypatch.setenv("WORKER_CACHE_DIR", str(tmp_path))
+    # Register the cache variables with monkeypatch so the values main() fills in are undone afterwards
+    for cache_envvar in ["CUDA_CACHE_PATH", "CUDA_CACHE_MAXSIZE", "OPTIX_CACHE_PATH"]:
+        monkeypatch.setenv(cache_envvar, "")
+        monkeypatch.delenv(cache_envvar)
+    monkeypatch.setattr(render_worker, "get_aws_client", {"s3": s3, "sqs": sqs}.get)
+    monkeypatch.setattr(render_worker, "gpu_probe_key", lambda: None)
+    fp.register(['nvidia-smi', '-L'], returncode=1)
+    fp.register(["/bin/blender/3.6.2/blender", "-b", "file.blend", "-o", os.path.join(os.getcwd(), "output_file_"),
+                 "-P", "render_with_gpu.py", "-f", "3"])
+    with open('output_file_0003.png', 'w') as f:
+        f.write('fake file')
+
+    main(["--startup-profile"])
+
+    phases = ["interpreter + imports", "env validation", "sqs client", "receive messages", "s3 client",
+              "gpu probe", "download blend", "render frame", "upload frame", "total"]
+    report = caplog.text[caplog.text.index("Startup profile"):]
+    positions = [report.index(phase) for phase in phases]
+    assert positions == sorted(positions)
+    assert os.environ["CUDA_CACHE_PATH"] == os.path.join(str(tmp_path), "nv")
+
+    os.remove('file.blend')
+    os.remove('output_file_0003.png')
+
+
 def test_get_messages(sqs):
     with open("resources/test_messages.json") as file:
         expected_messages = json.load(file)
@@ -148,7 +340,7 @@ def test_create_blender_command(sample_render_instruction):
     current_dir = os.getcwd()
     expected_output = ["/bin/blender/3.6.2/blender",
                        "-b", "file.blend",
-                       "-o", f"{current_dir}\\output_file_",
+                       "-o", os.path.join(current_dir, "output_file_"),
                        "-P", "render_with_gpu.py",
                        "-f", "3"]
     actual_output = create_blender_command(sample_render_instruction, None, False, None)
@@ -163,7 +355,7 @@ def test_create_blender_command(sample_render_instruction):
 
     expected_test_output = ["/bin/blender/3.6.2/blender",
                             "-b", "file.blend",
-                            "-o", f"{current_dir}\\output_file_",
+                            "-o", os.path.join(current_dir, "output_file_"),
                             "-P", "../src/render_with_gpu.py",
                             "-f", "3"]
 